@@ -0,0 +1,19 @@
+"""
+Gunicorn settings for running Claude Voice Assistant in production.
+
+Usage:
+    gunicorn -c gunicorn.conf.py server:app
+"""
+
+bind = "0.0.0.0:5001"
+worker_class = "gthread"
+workers = 1  # Sessions and streaming transcriptions live in process memory; never raise this
+threads = 8  # Chats mostly wait on the Claude API, so threads keep them concurrent
+
+
+def post_worker_init(worker):
+    """Warm up the Claude connection once the worker has loaded the app, like `python server.py` does."""
+    import server
+
+    if server.WARMUP:
+        server.warm_up_claude_client()
@@ -5,7 +5,9 @@ Claude Voice Assistant - Web Server
 A Flask-based web server that provides a browser interface for talking to Claude.
 
 Requirements:
-    pip install flask flask-cors openai-whisper anthropic python-dotenv
+    pip install -r requirements.txt
+    (flask, flask-cors, flask-compress, faster-whisper, numpy, numba, orjson,
+    msgspec, anthropic, httpx[http2], python-dotenv; ffmpeg on the PATH)
 
 Setup:
     1. Copy .env.example to .env and add your API key:
@@ -19,7 +21,7 @@ Setup:
 
 The server handles:
     - Receiving audio recordings from the browser
-    - Transcribing audio using Whisper
+    - Transcribing audio using Whisper (faster-whisper / CTranslate2)
     - Sending messages to Claude API
     - Returning responses to the browser
     - Persisting conversation history to disk
@@ -27,10 +29,14 @@ The server handles:
 
 import os
 import sys
+import gzip
+import hashlib
 import json
-import tempfile
-import base64
-import atexit
+import queue
+import re
+import subprocess
+import threading
+import time
 from pathlib import Path
 from datetime import datetime
 
@@ -38,31 +44,62 @@ from datetime import datetime
 from dotenv import load_dotenv
 load_dotenv()
 
-from flask import Flask, request, jsonify, send_from_directory
-from flask_cors import CORS
 
 # Configuration
-HISTORY_FILE = Path(__file__).parent / "conversation_history.json"
+HISTORY_DIR = Path(__file__).parent / "conversation_history"  # One JSONL file per session
+ARCHIVE_DIR = Path(__file__).parent / "conversation_history_archives"  # Monthly JSONL archives
+LEGACY_HISTORY_FILE = Path(__file__).parent / "conversation_history.json"
+PREVIEWS_FILE = Path(__file__).parent / "conversation_previews.jsonl"  # Append-only log of session previews
 MAX_HISTORY_MESSAGES = 20  # Increased from 20 to 100 messages per session
+MAX_CONTEXT_TOKENS = int(os.environ.get("MAX_CONTEXT_TOKENS", "8000"))  # Rough budget for history sent to Claude
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,128}$')
+SESSION_PAGE_SIZE = 100  # Maximum messages returned per /api/session/<id> request
+WHISPER_SAMPLE_RATE = 16000  # Whisper expects 16 kHz mono audio
+STREAM_TRIM_SECONDS = 15  # Trim confirmed audio from a stream's buffer once it grows past this
+STREAM_MAX_BUFFER_SECONDS = 30  # Whisper's context window; older audio is dropped beyond this
+STREAM_IDLE_SECONDS = 60  # Forget transcription streams that stop receiving chunks
+STREAM_MAX_ENCODED_BYTES = 16 * 1024 * 1024  # Cap on a stream's compressed audio (~1 hour of Opus)
+WHISPER_CONCURRENCY = int(os.environ.get("WHISPER_CONCURRENCY", "1"))  # Transcriptions allowed to run at once
+WARMUP = os.environ.get("WARMUP", "1") == "1"  # Set WARMUP=0 to skip startup warmup (e.g. in CI)
+
+# The page is a static shell, so read it once and serve it from memory
+INDEX_HTML = (Path(__file__).parent / "index.html").read_bytes()
+INDEX_ETAG = hashlib.md5(INDEX_HTML).hexdigest()
+INDEX_GZIP = gzip.compress(INDEX_HTML, 6)
+
+# Kept byte-for-byte identical across requests so Anthropic's prompt cache can reuse it
+SYSTEM_PROMPT = "You are a helpful voice assistant. Keep your responses concise and conversational since they will be displayed to a user who just spoke to you. Be friendly, natural, and helpful. Use markdown formatting when appropriate for readability."
+SYSTEM_BLOCKS = [{'type': 'text', 'text': SYSTEM_PROMPT, 'cache_control': {'type': 'ephemeral'}}]
 
 # Check dependencies before importing
 def check_dependencies():
     """Check that all required packages are installed."""
+    required = [
+        ("flask", "flask"),
+        ("flask_cors", "flask-cors"),
+        ("flask_compress", "flask-compress"),
+        ("faster_whisper", "faster-whisper"),
+        ("numpy", "numpy"),
+        ("numba", "numba"),
+        ("orjson", "orjson"),
+        ("msgspec", "msgspec"),
+        ("anthropic", "anthropic"),
+        ("httpx", "httpx[http2]"),
+        ("h2", "httpx[http2]"),
+    ]
     missing = []
     
-    try:
-        import whisper
-    except ImportError:
-        missing.append("openai-whisper")
-    
-    try:
-        import anthropic
-    except ImportError:
-        missing.append("anthropic")
+    for module, package in required:
+        try:
+            __import__(module)
+        except ImportError:
+            if package not in missing:
+                missing.append(package)
     
     if missing:
         print("Missing required packages. Install them with:")
-        print(f"  pip install flask flask-cors {' '.join(missing)}")
+        print(f"  pip install {' '.join(missing)}")
+        print("or install everything with: pip install -r requirements.txt")
         sys.exit(1)
     
     if not os.environ.get("ANTHROPIC_API_KEY"):
@@ -74,86 +111,797 @@ def check_dependencies():
 
 check_dependencies()
 
-import whisper
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
+from flask.json.provider import JSONProvider
+from flask_cors import CORS
+from flask_compress import Compress
+from werkzeug.http import parse_options_header
+import numpy as np
+import numba
+import orjson
+import msgspec
+import ctranslate2
+from faster_whisper import WhisperModel
 import anthropic
+import httpx
+
+class OrjsonProvider(JSONProvider):
+    """Route jsonify() and request.get_json() through orjson instead of stdlib json."""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Skip the bytes -> str -> bytes round trip dumps() would force
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
+
 
 # Initialize Flask app
 app = Flask(__name__, static_folder='static')
+app.json = OrjsonProvider(app)
 CORS(app)
 
+# Compress JSON bodies such as session transcripts. SSE is left out: the
+# encoder would buffer events instead of flushing each one to the client.
+# The index page is served pre-gzipped by index() and handles its own encoding.
+app.config['COMPRESS_MIMETYPES'] = ['application/json']
+app.config['COMPRESS_MIN_SIZE'] = 1024  # Smaller bodies aren't worth the CPU
+app.config['COMPRESS_STREAMS'] = False
+Compress(app)
+
 # Global variables
 whisper_model = None
 claude_client = None
 conversation_histories = {}  # Store conversations by session ID
 
+whisper_model_lock = threading.Lock()  # Guards lazy loading of the Whisper model
+claude_client_lock = threading.Lock()  # Guards lazy creation of the Claude client
+# Each transcription is memory-heavy, so cap how many run at once
+transcribe_semaphore = threading.Semaphore(WHISPER_CONCURRENCY)
+history_lock = threading.RLock()  # Guards conversation_histories, the session index and the history files
+transcription_streams = {}  # stream_id -> TranscriptionStream
+transcription_streams_lock = threading.Lock()
+
+# Session summaries kept in step with conversation_histories so listing never scans messages
+session_index = {}  # session_id -> {'message_count', 'preview', 'updated_at'}
+session_previews = {}  # session_id -> first user message, fixed once set
+session_generations = {}  # session_id -> bumped on clear/delete, so in-flight turns don't write into the new session
+context_starts = {}  # session_id -> first message last sent to Claude, keeps the cached prefix stable
+sessions_version = 0  # Bumped on every mutation; keys the cached /api/sessions payload
+_sessions_payload = (-1, None)  # (sessions_version, serialized JSON)
+
+
+class Msg(msgspec.Struct, gc=False):
+    """A single conversation message."""
+    role: str
+    content: str
+
+
+_msg_encoder = msgspec.json.Encoder()
+_msg_decoder = msgspec.json.Decoder(Msg)
+
+
+def session_path(session_id):
+    """Return the JSONL file for a session, rejecting IDs that are not safe filenames."""
+    if not SESSION_ID_PATTERN.match(session_id):
+        raise ValueError(f"Invalid session_id: {session_id!r}")
+    return HISTORY_DIR / f"{session_id}.jsonl"
+
+
+def _read_jsonl(path):
+    """Read messages from a JSONL file, skipping blank or truncated lines."""
+    messages = []
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                messages.append(_msg_decoder.decode(line))
+            except msgspec.DecodeError:
+                # A crash mid-append can leave a partial last line behind
+                print(f"⚠ Skipping corrupt line in {path.name}")
+    return messages
+
+
+def _append_jsonl(path, records):
+    """Append records to a JSONL file with a single O_APPEND write."""
+    payload = _msg_encoder.encode_lines(records)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, payload)
+    finally:
+        os.close(fd)
+
+
+def _make_preview(content):
+    """Shorten a message to the 100-character preview shown in the session list."""
+    return content[:100] + ('...' if len(content) > 100 else '')
+
+
+def _log_preview(session_id, preview):
+    """Append a preview change to PREVIEWS_FILE; a preview of None drops the session's entry."""
+    try:
+        _append_jsonl(PREVIEWS_FILE, [{'session_id': session_id, 'preview': preview}])
+    except IOError as e:
+        print(f"⚠ Could not save preview for {session_id}: {e}")
+
+
+def _load_previews():
+    """
+    Replay PREVIEWS_FILE into session_previews.
+    
+    Returns the number of records read, so the caller can tell whether the
+    log is worth compacting.
+    """
+    session_previews.clear()
+    records = 0
+    try:
+        with open(PREVIEWS_FILE, 'rb') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    print(f"⚠ Skipping corrupt line in {PREVIEWS_FILE.name}")
+                    continue
+                records += 1
+                if record['preview'] is None:
+                    session_previews.pop(record['session_id'], None)
+                else:
+                    session_previews[record['session_id']] = record['preview']
+    except FileNotFoundError:
+        pass
+    except IOError as e:
+        print(f"⚠ Could not load session previews: {e}")
+    return records
+
+
+def _compact_previews():
+    """Rewrite PREVIEWS_FILE with one record per live session."""
+    try:
+        temp_file = PREVIEWS_FILE.with_suffix('.tmp')
+        with open(temp_file, 'wb') as f:
+            f.write(_msg_encoder.encode_lines([
+                {'session_id': session_id, 'preview': preview}
+                for session_id, preview in session_previews.items()
+            ]))
+        os.replace(temp_file, PREVIEWS_FILE)
+    except IOError as e:
+        print(f"⚠ Could not compact session previews: {e}")
+
+
+def forget_session_preview(session_id):
+    """
+    Drop a session's preview so its next user message sets a new one.
+    
+    Callers must hold history_lock.
+    """
+    if session_previews.pop(session_id, None) is not None:
+        _log_preview(session_id, None)
+
+
+def _migrate_legacy_history():
+    """Convert a monolithic conversation_history.json into per-session files."""
+    try:
+        with open(LEGACY_HISTORY_FILE, 'r', encoding='utf-8') as f:
+            conversations = json.load(f).get('conversations', {})
+    except (json.JSONDecodeError, IOError) as e:
+        print(f"⚠ Could not migrate legacy history file: {e}")
+        return
+    
+    migrated = 0
+    for session_id, history in conversations.items():
+        if not history or not SESSION_ID_PATTERN.match(session_id):
+            continue
+        _append_jsonl(session_path(session_id), history)
+        migrated += 1
+    
+    LEGACY_HISTORY_FILE.rename(LEGACY_HISTORY_FILE.with_suffix('.json.migrated'))
+    print(f"✓ Migrated {migrated} conversation(s) from {LEGACY_HISTORY_FILE.name}")
+
+
+def update_session_index(session_id, updated_at=None):
+    """
+    Refresh the cached summary for a session and invalidate the listing cache.
+    
+    Callers must hold history_lock.
+    """
+    global sessions_version
+    
+    history = conversation_histories.get(session_id)
+    if history is None:
+        session_index.pop(session_id, None)
+    else:
+        session_index[session_id] = {
+            'message_count': len(history),
+            'preview': session_previews.get(session_id, ''),
+            'updated_at': updated_at or datetime.now().isoformat()
+        }
+    
+    sessions_version += 1
+
 
 def load_conversation_history():
     """Load conversation history from disk."""
     global conversation_histories
     
-    if HISTORY_FILE.exists():
+    HISTORY_DIR.mkdir(exist_ok=True)
+    ARCHIVE_DIR.mkdir(exist_ok=True)
+    
+    if LEGACY_HISTORY_FILE.exists():
+        _migrate_legacy_history()
+    
+    # Compact the preview log when it holds anything besides one record per live session
+    compact_previews = _load_previews() != len(session_previews)
+    
+    conversation_histories = {}
+    session_index.clear()
+    for path in HISTORY_DIR.glob('*.jsonl'):
         try:
-            with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                conversation_histories = data.get('conversations', {})
-                print(f"✓ Loaded {len(conversation_histories)} conversation(s) from disk")
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"⚠ Could not load history file: {e}")
-            conversation_histories = {}
+            history = conversation_histories[path.stem] = _read_jsonl(path)
+            if path.stem not in session_previews:
+                # Sessions saved before previews were persisted: best effort from what is left
+                first_user = next((msg for msg in history if msg.role == 'user'), None)
+                if first_user is not None:
+                    session_previews[path.stem] = _make_preview(first_user.content)
+                    compact_previews = True
+            modified = datetime.fromtimestamp(path.stat().st_mtime).isoformat()
+            update_session_index(path.stem, updated_at=modified)
+        except IOError as e:
+            print(f"⚠ Could not load {path.name}: {e}")
+    
+    # Previews of sessions whose files are gone are stale
+    for session_id in session_previews.keys() - conversation_histories.keys():
+        del session_previews[session_id]
+        compact_previews = True
+    if compact_previews:
+        _compact_previews()
+    
+    if conversation_histories:
+        print(f"✓ Loaded {len(conversation_histories)} conversation(s) from disk")
     else:
-        print("✓ No existing history file, starting fresh")
+        print("✓ No existing history, starting fresh")
 
 
-def save_conversation_history():
-    """Save conversation history to disk."""
+def append_to_history(session_id, message):
+    """
+    Add a message to a session and persist it.
+    
+    Each message costs a single line appended to the session's JSONL file.
+    Once a session grows past twice MAX_HISTORY_MESSAGES the oldest messages
+    are moved to conversation_history_archives/YYYY-MM.jsonl and the session
+    file is rewritten with the newest MAX_HISTORY_MESSAGES. The slack means
+    the file is only rewritten every MAX_HISTORY_MESSAGES messages, and the
+    session always keeps at least MAX_HISTORY_MESSAGES of context.
+    """
+    with history_lock:
+        history = conversation_histories.setdefault(session_id, [])
+        history.append(message)
+        path = session_path(session_id)
+        
+        # The preview is the session's first user message, so it survives archiving
+        if message.role == 'user' and session_id not in session_previews:
+            session_previews[session_id] = _make_preview(message.content)
+            _log_preview(session_id, session_previews[session_id])
+        
+        try:
+            if len(history) <= 2 * MAX_HISTORY_MESSAGES:
+                _append_jsonl(path, [message])
+                return
+            
+            # Claude requires the conversation to open with a user turn
+            cut = len(history) - MAX_HISTORY_MESSAGES
+            while cut < len(history) and history[cut].role != 'user':
+                cut += 1
+            expired, retained = history[:cut], history[cut:]
+            
+            # Archive everything that no longer fits, tagged with its session
+            archive_file = ARCHIVE_DIR / f"{datetime.now():%Y-%m}.jsonl"
+            _append_jsonl(archive_file, [{'session_id': session_id, 'role': msg.role, 'content': msg.content} for msg in expired])
+            
+            temp_file = path.with_suffix('.tmp')
+            with open(temp_file, 'wb') as f:
+                f.write(_msg_encoder.encode_lines(retained))
+            os.replace(temp_file, path)
+            
+            conversation_histories[session_id] = retained
+        except IOError as e:
+            print(f"⚠ Could not save history for {session_id}: {e}")
+        finally:
+            update_session_index(session_id)
+
+
+def remove_history_file(session_id):
+    """Delete a session's history file if it exists."""
     try:
-        data = {
-            'last_saved': datetime.now().isoformat(),
-            'conversations': conversation_histories
-        }
-        with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-        print(f"✓ Saved {len(conversation_histories)} conversation(s) to disk")
+        os.unlink(session_path(session_id))
+    except FileNotFoundError:
+        pass
     except IOError as e:
-        print(f"⚠ Could not save history file: {e}")
+        print(f"⚠ Could not remove history for {session_id}: {e}")
 
 
 # Load history on startup
 load_conversation_history()
 
-# Save history on shutdown
-atexit.register(save_conversation_history)
-
 
 def get_whisper_model():
     """Lazy load Whisper model."""
     global whisper_model
-    if whisper_model is None:
-        model_name = os.environ.get("WHISPER_MODEL", "base")
-        print(f"Loading Whisper model '{model_name}'... ", end="", flush=True)
-        whisper_model = whisper.load_model(model_name)
-        print("Done!")
-    return whisper_model
+    with whisper_model_lock:
+        if whisper_model is None:
+            model_name = os.environ.get("WHISPER_MODEL", "base")
+            device = os.environ.get("WHISPER_DEVICE") or ("cuda" if ctranslate2.get_cuda_device_count() else "cpu")
+            # Quantized weights: int8 on CPU, int8 weights with float16 activations on GPU
+            compute_type = "int8_float16" if device == "cuda" else "int8"
+            # 0 keeps CTranslate2's default (which honours OMP_NUM_THREADS). Each
+            # concurrent transcription gets its own worker so they don't queue.
+            cpu_threads = int(os.environ.get("WHISPER_CPU_THREADS", "0"))
+            print(f"Loading Whisper model '{model_name}' ({device}, {compute_type})... ", end="", flush=True)
+            whisper_model = WhisperModel(
+                model_name,
+                device=device,
+                compute_type=compute_type,
+                cpu_threads=cpu_threads,
+                num_workers=WHISPER_CONCURRENCY
+            )
+            print("Done!")
+            
+            if WARMUP:
+                # Run one inference on a second of silence so buffer allocation and
+                # kernel setup happen now instead of on the first real request
+                print("Warming up Whisper... ", end="", flush=True)
+                segments, _ = whisper_model.transcribe(
+                    np.zeros(WHISPER_SAMPLE_RATE, dtype=np.float32), language='en', beam_size=1
+                )
+                list(segments)  # Segments are decoded lazily
+                print("Done!")
+        return whisper_model
 
 
 def get_claude_client():
     """Get Claude API client."""
     global claude_client
-    if claude_client is None:
-        claude_client = anthropic.Anthropic()
-    return claude_client
+    with claude_client_lock:
+        if claude_client is None:
+            # One long-lived HTTP/2 pool shared by all request threads, so turns
+            # reuse a warm connection instead of paying a TCP+TLS handshake.
+            # DefaultHttpxClient matches the httpx build the SDK was shipped with.
+            claude_client = anthropic.Anthropic(http_client=anthropic.DefaultHttpxClient(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=32, keepalive_expiry=300.0),
+                timeout=anthropic.Timeout(60.0, connect=5.0)
+            ))
+        return claude_client
+
+
+# Load the models at import time rather than on first use, so the first
+# request doesn't wait for them. Run a single process only: sessions and
+# streaming transcriptions are kept in this process's memory.
+get_whisper_model()
+get_claude_client()
+
+
+def trim_history(session_id, history):
+    """
+    Return the most recent messages that fit within MAX_CONTEXT_TOKENS.
+    
+    Tokens are estimated at four characters each. The window starts where the
+    previous turn's did, so the prefix Claude has cached stays the same. Only
+    when that runs over budget is it cut, down to about half the budget, which
+    leaves room for several more turns before the prefix moves again. The
+    newest message is always kept, and the result always opens with a user
+    turn as Claude requires. The message count is bounded by the retained
+    history (see append_to_history()). Callers must hold history_lock.
+    """
+    anchor = context_starts.get(session_id)
+    start = next((i for i, msg in enumerate(history) if msg is anchor), 0)
+    tokens = sum(len(msg.content) // 4 for msg in history[start:])
+    
+    if tokens > MAX_CONTEXT_TOKENS:
+        while tokens > MAX_CONTEXT_TOKENS // 2 and start < len(history) - 1:
+            tokens -= len(history[start].content) // 4
+            start += 1
+    
+    while start < len(history) - 1 and history[start].role != 'user':
+        start += 1
+    
+    if history:
+        context_starts[session_id] = history[start]
+    return history[start:]
+
+
+def build_claude_messages(history):
+    """
+    Convert stored history into the messages payload for Claude.
+    
+    The second-to-last message (the previous assistant reply) is marked as a
+    prompt cache checkpoint, so the next turn reads everything up to it from
+    Anthropic's cache instead of prefilling it again. Together with the system
+    prompt this uses two of the four cache breakpoints a request may carry.
+    Stored history is never modified.
+    """
+    messages = [{'role': msg.role, 'content': msg.content} for msg in history]
+    
+    if len(messages) >= 2:
+        checkpoint = messages[-2]
+        checkpoint['content'] = [{
+            'type': 'text',
+            'text': checkpoint['content'],
+            'cache_control': {'type': 'ephemeral'}
+        }]
+    
+    return messages
+
+
+def stream_claude_reply(messages):
+    """Stream Claude's reply to a messages payload, yielding text chunks."""
+    with get_claude_client().messages.stream(
+        model=os.environ.get("CLAUDE_MODEL", "claude-sonnet-4-5-20250929"),
+        max_tokens=8192,
+        system=SYSTEM_BLOCKS,
+        messages=messages
+    ) as stream:
+        yield from stream.text_stream
+
+
+def run_turn(session_id, message, reply=None):
+    """
+    Run one conversation turn, yielding Claude's reply chunk by chunk.
+    
+    Adds the user message to history, sends the trimmed history to Claude and
+    stores the full reply once it finishes. Pass `reply` to use a reply that
+    was already started for this exact message (see BackgroundReply).
+    """
+    with history_lock:
+        # Add user message to history
+        append_to_history(session_id, Msg(role='user', content=message))
+        messages = build_claude_messages(trim_history(session_id, conversation_histories[session_id]))
+        generation = session_generations.get(session_id, 0)
+    
+    full_response = ""
+    for text in reply if reply is not None else stream_claude_reply(messages):
+        full_response += text
+        yield text
+    
+    with history_lock:
+        # Add assistant response to history (unless the session was cleared or deleted meanwhile)
+        if session_generations.get(session_id, 0) == generation:
+            append_to_history(session_id, Msg(role='assistant', content=full_response))
+
+
+class BackgroundReply:
+    """
+    A Claude reply streamed on a background thread.
+    
+    Lets a reply start before the caller is ready to consume it (and be
+    abandoned if it turns out to be unneeded). Iterate over it to receive the
+    text chunks in order.
+    """
+    
+    def __init__(self, messages):
+        self._chunks = queue.Queue()
+        self._cancelled = threading.Event()
+        threading.Thread(target=self._run, args=(messages,), daemon=True).start()
+    
+    def _run(self, messages):
+        chunks = stream_claude_reply(messages)
+        try:
+            for text in chunks:
+                if self._cancelled.is_set():
+                    return
+                self._chunks.put(text)
+            self._chunks.put(None)
+        except Exception as e:
+            self._chunks.put(e)
+        finally:
+            chunks.close()  # Closes the HTTP stream if we stopped early
+    
+    def cancel(self):
+        """Stop generating; takes effect when the next chunk arrives."""
+        self._cancelled.set()
+    
+    def __iter__(self):
+        while True:
+            item = self._chunks.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+def warm_up_claude_client():
+    """Open a connection to the Anthropic API in the background so the first chat skips the handshake."""
+    def warm_up():
+        try:
+            get_claude_client().messages.count_tokens(
+                model=os.environ.get("CLAUDE_MODEL", "claude-sonnet-4-5-20250929"),
+                messages=[{'role': 'user', 'content': 'ping'}]
+            )
+        except Exception as e:
+            print(f"⚠ Claude warmup failed: {e}")
+    
+    threading.Thread(target=warm_up, daemon=True).start()
 
 
 @app.route('/')
 def index():
-    """Serve the main HTML page."""
-    return send_from_directory('.', 'index.html')
+    """Serve the main HTML page from memory, gzipped when the browser accepts it."""
+    # Each content-coding is a different representation, so each gets its own strong ETag
+    use_gzip = request.accept_encodings['gzip'] > 0
+    etag = INDEX_ETAG + '-gz' if use_gzip else INDEX_ETAG
+    headers = {'ETag': f'"{etag}"', 'Vary': 'Accept-Encoding'}
+    
+    if etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+    
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+        return Response(INDEX_GZIP, mimetype='text/html', headers=headers)
+    
+    return Response(INDEX_HTML, mimetype='text/html', headers=headers)
 
 
 @app.route('/static/<path:filename>')
 def serve_static(filename):
     """Serve static files."""
-    return send_from_directory('static', filename)
+    response = send_from_directory('static', filename)
+    # Static assets are expected to carry a content hash in their filename
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+@numba.njit(cache=True, fastmath=True)
+def preprocess_pcm(frames, gain):
+    """
+    Downmix int16 PCM frames (samples x channels) to mono float32 in one pass.
+    
+    Averages the channels, converts to [-1, 1) and applies gain. This is
+    compiled by Numba; keep everything else out of it. It is deliberately not
+    parallel: request threads call it concurrently, which Numba's fallback
+    workqueue threading layer aborts the process on, and a serial loop is
+    already well under a millisecond for 10 s of audio.
+    """
+    n, channels = frames.shape
+    scale = np.float32(gain / (32768.0 * channels))
+    out = np.empty(n, dtype=np.float32)
+    for i in range(n):
+        acc = np.float32(0.0)
+        for c in range(channels):
+            acc += frames[i, c]
+        out[i] = acc * scale
+    return out
+
+
+if WARMUP:
+    # Compile preprocess_pcm now (or load it from Numba's on-disk cache) instead
+    # of on the first PCM upload. Uploads arrive as read-only buffers, which
+    # Numba types separately, so warm it with one.
+    preprocess_pcm(np.frombuffer(bytes(4), dtype=np.int16).reshape(-1, 2), 1.0)
+
+
+class InvalidAudioError(ValueError):
+    """Raised when an upload's Content-Type or body isn't acceptable audio; reported as a 400."""
+
+
+def parse_audio_type(content_type):
+    """Split an audio Content-Type into (mimetype, channels), validating the channels parameter."""
+    mimetype, params = parse_options_header(content_type or '')
+    channels = params.get('channels', '1')
+    if not channels.isdigit() or int(channels) < 1:
+        raise InvalidAudioError(f"Invalid channels parameter: {channels!r}")
+    return mimetype.lower(), int(channels)
+
+
+def pcm_frame_bytes(content_type):
+    """Return the size of one frame for the raw PCM types, or None for compressed formats."""
+    mimetype, channels = parse_audio_type(content_type)
+    if mimetype == 'audio/pcm':
+        return 4 * channels
+    if mimetype == 'audio/pcm-s16le':
+        return 2 * channels
+    return None
+
+
+def decode_audio(data, content_type):
+    """
+    Convert an uploaded recording into 16 kHz mono float32 samples for Whisper.
+    
+    Raw PCM is decoded directly:
+        - 'audio/pcm': little-endian float32, mono, 16 kHz, used as-is
+        - 'audio/pcm-s16le': little-endian int16, 16 kHz, interleaved with
+          a 'channels' parameter (default 1), downmixed by preprocess_pcm()
+    Anything else (webm, ogg, mp4...) is piped through ffmpeg in memory, so no
+    temp file ever touches the disk. Malformed PCM raises InvalidAudioError.
+    """
+    mimetype, channels = parse_audio_type(content_type)
+    
+    if mimetype == 'audio/pcm':
+        if channels != 1:
+            raise InvalidAudioError("audio/pcm must be mono; send multichannel audio as audio/pcm-s16le")
+        if len(data) % 4:
+            raise InvalidAudioError("audio/pcm body must be a whole number of float32 samples")
+        return np.frombuffer(data, dtype=np.float32)
+    
+    if mimetype == 'audio/pcm-s16le':
+        if len(data) % 2:
+            raise InvalidAudioError("audio/pcm-s16le body must be a whole number of int16 samples")
+        frames = np.frombuffer(data, dtype=np.int16)
+        frames = frames[:len(frames) - len(frames) % channels].reshape(-1, channels)
+        return preprocess_pcm(frames, 1.0)
+    
+    result = subprocess.run(
+        ['ffmpeg', '-nostdin', '-loglevel', 'error', '-threads', '0',
+         '-i', 'pipe:0',
+         '-f', 'f32le', '-acodec', 'pcm_f32le', '-ac', '1', '-ar', str(WHISPER_SAMPLE_RATE),
+         'pipe:1'],
+        input=data,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=False
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to decode audio: {result.stderr.decode(errors='replace').strip()}")
+    
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
+class TranscriptionStream:
+    """State for one recording being transcribed while it is still in progress."""
+    
+    def __init__(self, content_type):
+        self.lock = threading.Lock()
+        self.content_type = content_type
+        self.encoded = bytearray()  # Every chunk received so far, in order (raw PCM: from dropped_samples on)
+        self.frame_bytes = pcm_frame_bytes(content_type)  # None unless the stream is raw PCM
+        self.dropped_samples = 0  # Raw PCM samples already transcribed and dropped from encoded
+        self.buffer_offset = 0  # First sample of the decoded audio still being transcribed
+        self.committed_words = []  # (start, end, word) confirmed by LocalAgreement-2
+        self.confirmed_text = ""
+        self.last_committed_ts = 0.0
+        self.prev_output = []  # Unconfirmed words from the previous round
+        self.last_activity = time.monotonic()
+
+
+def get_transcription_stream(stream_id, content_type):
+    """Return the state for a stream, creating it and expiring idle ones as needed."""
+    now = time.monotonic()
+    with transcription_streams_lock:
+        for expired_id in [sid for sid, st in transcription_streams.items()
+                           if now - st.last_activity > STREAM_IDLE_SECONDS]:
+            del transcription_streams[expired_id]
+        
+        stream = transcription_streams.get(stream_id)
+        if stream is None:
+            stream = transcription_streams[stream_id] = TranscriptionStream(content_type)
+        stream.last_activity = now
+        return stream
+
+
+def _normalize_word(word):
+    return word.strip().lower()
+
+
+def _drop_repeated_words(words, committed_words):
+    """
+    Drop words at the start of a hypothesis that repeat the committed tail.
+    
+    Whisper's timestamps jitter between rounds, so the last committed word or
+    two can reappear at the start of the next hypothesis just after the
+    commit point. Compare up to five words.
+    """
+    if not words or not committed_words:
+        return words
+    for n in range(min(5, len(words), len(committed_words)), 0, -1):
+        tail = [_normalize_word(w[2]) for w in committed_words[-n:]]
+        head = [_normalize_word(w[2]) for w in words[:n]]
+        if tail == head:
+            return words[n:]
+    return words
+
+
+def transcribe_stream_round(stream, final=False):
+    """
+    Transcribe a stream's buffered audio and commit the words that are stable.
+    
+    Uses LocalAgreement-2: a word is confirmed only once two consecutive
+    rounds agree on it (as the longest common prefix of their hypotheses).
+    On the final round everything left is committed. Confirmed audio is
+    trimmed from the buffer once it exceeds STREAM_TRIM_SECONDS, and the
+    buffer never grows past Whisper's 30 second window.
+    
+    Returns the newly confirmed text. Callers must hold stream.lock.
+    """
+    data = bytes(stream.encoded)
+    if stream.frame_bytes:
+        # Raw PCM chunks can end mid-frame; the partial frame waits for the next chunk
+        data = data[:len(data) - len(data) % stream.frame_bytes]
+    audio = decode_audio(data, stream.content_type)
+    buffer = audio[stream.buffer_offset - stream.dropped_samples:]
+    if len(buffer) == 0:
+        return ""
+    offset_time = stream.buffer_offset / WHISPER_SAMPLE_RATE
+    
+    model = get_whisper_model()
+    with transcribe_semaphore:
+        segments, _ = model.transcribe(
+            buffer,
+            beam_size=1,
+            word_timestamps=True,
+            condition_on_previous_text=False,
+            initial_prompt=stream.confirmed_text[-200:] or None
+        )
+        words = [
+            (offset_time + w.start, offset_time + w.end, w.word)
+            for segment in segments for w in segment.words
+        ]
+    
+    # Skip words that belong to audio already committed in an earlier round
+    words = [w for w in words if w[0] > stream.last_committed_ts - 0.1]
+    words = _drop_repeated_words(words, stream.committed_words)
+    
+    if final:
+        committed = words
+    else:
+        committed = []
+        for new, old in zip(words, stream.prev_output):
+            if _normalize_word(new[2]) != _normalize_word(old[2]):
+                break
+            committed.append(new)
+    stream.prev_output = words[len(committed):]
+    
+    text = ''.join(w[2] for w in committed)
+    if committed:
+        stream.committed_words.extend(committed)
+        stream.last_committed_ts = committed[-1][1]
+        stream.confirmed_text += text
+    
+    # Trim confirmed audio, and anything that falls outside Whisper's window
+    buffer_end = (stream.dropped_samples + len(audio)) / WHISPER_SAMPLE_RATE
+    trim_to = offset_time
+    if buffer_end - offset_time > STREAM_TRIM_SECONDS:
+        trim_to = max(trim_to, stream.last_committed_ts)
+    if buffer_end - trim_to > STREAM_MAX_BUFFER_SECONDS:
+        trim_to = buffer_end - STREAM_MAX_BUFFER_SECONDS
+        stream.prev_output = [w for w in stream.prev_output if w[0] >= trim_to]
+    stream.buffer_offset = max(stream.buffer_offset, int(trim_to * WHISPER_SAMPLE_RATE))
+    
+    if stream.frame_bytes:
+        # Raw PCM decodes frame by frame, so trimmed audio never needs decoding again
+        del stream.encoded[:(stream.buffer_offset - stream.dropped_samples) * stream.frame_bytes]
+        stream.dropped_samples = stream.buffer_offset
+    
+    return text
+
+
+def feed_transcription_stream(stream, chunk, final=False):
+    """
+    Add a chunk to a stream and run a transcription round over it.
+    
+    If the round fails (an undecodable chunk, for example) the chunk is taken
+    out again so the stream can carry on with the next one. Raises
+    InvalidAudioError once a compressed stream grows past
+    STREAM_MAX_ENCODED_BYTES, since every round decodes it from the start.
+    Callers must hold stream.lock.
+    """
+    if len(stream.encoded) + len(chunk) > STREAM_MAX_ENCODED_BYTES:
+        raise InvalidAudioError("Recording is too long to transcribe as a stream")
+    
+    size = len(stream.encoded)
+    stream.encoded += chunk
+    try:
+        return transcribe_stream_round(stream, final=final) if stream.encoded else ""
+    except Exception:
+        del stream.encoded[size:]
+        raise
 
 
 @app.route('/api/transcribe', methods=['POST'])
@@ -161,42 +909,84 @@ def transcribe_audio():
     """
     Transcribe audio using Whisper.
     
-    Expects JSON with:
-        - audio: base64-encoded audio data (webm format)
+    Expects the raw recording as the request body, with Content-Type set to
+    the recording's format (e.g. audio/webm), or one of the raw PCM types
+    accepted by decode_audio().
     
     Returns:
         - text: transcribed text
     """
     try:
-        data = request.get_json()
+        audio_data = request.get_data()
         
-        if 'audio' not in data:
+        if not audio_data:
             return jsonify({'error': 'No audio data provided'}), 400
         
-        # Decode base64 audio
-        audio_data = base64.b64decode(data['audio'])
+        audio = decode_audio(audio_data, request.content_type)
         
-        # Save to temporary file
-        with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as f:
-            temp_path = f.name
-            f.write(audio_data)
+        # Transcribe with Whisper (greedy decoding, silence skipped by VAD)
+        model = get_whisper_model()
+        with transcribe_semaphore:
+            segments, _ = model.transcribe(audio, beam_size=1, vad_filter=True)
+            # Segments are decoded lazily, so consume them while holding the slot
+            text = ''.join(segment.text for segment in segments).strip()
         
-        try:
-            # Transcribe with Whisper
-            model = get_whisper_model()
-            result = model.transcribe(temp_path)
-            text = result['text'].strip()
-            
-            return jsonify({'text': text})
-        finally:
-            # Clean up temp file
-            os.unlink(temp_path)
+        return jsonify({'text': text})
+    
+    except InvalidAudioError as e:
+        return jsonify({'error': str(e)}), 400
             
     except Exception as e:
         print(f"Transcription error: {e}")
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/transcribe/stream', methods=['POST'])
+def transcribe_stream():
+    """
+    Transcribe a recording incrementally while it is still being made.
+    
+    The client POSTs each new chunk of the recording (the bytes MediaRecorder
+    produced since the previous request) as the request body, one request at
+    a time, and marks the last one as final.
+    
+    Query parameters:
+        - stream_id: client-chosen identifier for the recording
+        - final: '1' on the last chunk, which flushes all remaining words
+    
+    Returns:
+        - text: words newly confirmed by this chunk
+        - confirmed: all confirmed text so far (the full transcript when final)
+        - final: whether the stream is finished
+    """
+    stream_id = request.args.get('stream_id', '')
+    final = request.args.get('final') == '1'
+    
+    if not SESSION_ID_PATTERN.match(stream_id):
+        return jsonify({'error': 'Invalid stream_id'}), 400
+    
+    try:
+        stream = get_transcription_stream(stream_id, request.content_type)
+        
+        with stream.lock:
+            text = feed_transcription_stream(stream, request.get_data(), final=final)
+            confirmed = stream.confirmed_text.strip()
+        
+        return jsonify({'text': text, 'confirmed': confirmed, 'final': final})
+    
+    except InvalidAudioError as e:
+        return jsonify({'error': str(e)}), 400
+        
+    except Exception as e:
+        print(f"Stream transcription error: {e}")
+        return jsonify({'error': str(e)}), 500
+    
+    finally:
+        if final:
+            with transcription_streams_lock:
+                transcription_streams.pop(stream_id, None)
+
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """
@@ -218,42 +1008,11 @@ def chat():
         message = data['message']
         session_id = data.get('session_id', 'default')
         
-        # Get or create conversation history for this session
-        if session_id not in conversation_histories:
-            conversation_histories[session_id] = []
+        if not SESSION_ID_PATTERN.match(session_id):
+            return jsonify({'error': 'Invalid session_id'}), 400
         
-        history = conversation_histories[session_id]
-        
-        # Add user message to history
-        history.append({
-            'role': 'user',
-            'content': message
-        })
-        
-        # Get Claude response
-        client = get_claude_client()
-        response = client.messages.create(
-            model=os.environ.get("CLAUDE_MODEL", "claude-sonnet-4-5-20250929"),
-            max_tokens=8192,
-            system="You are a helpful voice assistant. Keep your responses concise and conversational since they will be displayed to a user who just spoke to you. Be friendly, natural, and helpful. Use markdown formatting when appropriate for readability.",
-            messages=history
-        )
-        
-        assistant_message = response.content[0].text
-        
-        # Add assistant response to history
-        history.append({
-            'role': 'assistant',
-            'content': assistant_message
-        })
-        
-        # Limit history size to prevent token overflow
-        if len(history) > MAX_HISTORY_MESSAGES:
-            history = history[-MAX_HISTORY_MESSAGES:]
-            conversation_histories[session_id] = history
-        
-        # Save to disk after each exchange
-        save_conversation_history()
+        # Get Claude response (streamed internally, returned whole)
+        assistant_message = ''.join(run_turn(session_id, message))
         
         return jsonify({'response': assistant_message})
         
@@ -274,8 +1033,6 @@ def chat_stream():
     Returns:
         - Server-sent events with streamed response chunks
     """
-    from flask import Response, stream_with_context
-    
     data = request.get_json()
     
     if 'message' not in data:
@@ -284,54 +1041,114 @@ def chat_stream():
     message = data['message']
     session_id = data.get('session_id', 'default')
     
-    # Get or create conversation history for this session
-    if session_id not in conversation_histories:
-        conversation_histories[session_id] = []
+    if not SESSION_ID_PATTERN.match(session_id):
+        return jsonify({'error': 'Invalid session_id'}), 400
+    
+    def generate():
+        try:
+            for text in run_turn(session_id, message):
+                # Send each chunk as a server-sent event
+                yield b"data: " + orjson.dumps({'chunk': text}) + b"\n\n"
+            
+            # Send done signal
+            yield b"data: " + orjson.dumps({'done': True}) + b"\n\n"
+            
+        except Exception as e:
+            print(f"Stream error: {e}")
+            yield b"data: " + orjson.dumps({'error': str(e)}) + b"\n\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
+@app.route('/api/voice_turn', methods=['POST'])
+def voice_turn():
+    """
+    Finish a streamed recording and get Claude's reply in one request.
     
-    history = conversation_histories[session_id]
+    The body is the last chunk of a recording whose earlier chunks went to
+    /api/transcribe/stream. While Whisper transcribes that tail, Claude is
+    already answering the words confirmed during recording. If the tail adds
+    or changes words, that speculative reply is cancelled and restarted with
+    the final transcript.
     
-    # Add user message to history
-    history.append({
-        'role': 'user',
-        'content': message
-    })
+    Query parameters:
+        - stream_id: the recording's stream identifier
+        - session_id: unique session identifier (optional)
+    
+    Returns:
+        - Server-sent events: transcript_delta (newly transcribed text),
+          transcript (the final user message), response_delta (reply
+          chunks), then done or error
+    """
+    stream_id = request.args.get('stream_id', '')
+    session_id = request.args.get('session_id', 'default')
+    
+    if not SESSION_ID_PATTERN.match(stream_id):
+        return jsonify({'error': 'Invalid stream_id'}), 400
+    if not SESSION_ID_PATTERN.match(session_id):
+        return jsonify({'error': 'Invalid session_id'}), 400
+    try:
+        parse_audio_type(request.content_type)
+    except InvalidAudioError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    stream = get_transcription_stream(stream_id, request.content_type)
+    audio_tail = request.get_data()
     
     def generate():
+        reply = None
         try:
-            client = get_claude_client()
-            full_response = ""
+            with stream.lock:
+                # Start answering what was already confirmed while the tail is transcribed.
+                # Only worth it when no words are still awaiting confirmation; otherwise the
+                # final round will almost certainly change the message and waste the request.
+                speculative_text = stream.confirmed_text.strip()
+                if speculative_text and not stream.prev_output:
+                    with history_lock:
+                        history = list(conversation_histories.get(session_id, []))
+                        history.append(Msg(role='user', content=speculative_text))
+                        messages = build_claude_messages(trim_history(session_id, history))
+                    reply = BackgroundReply(messages)
+                
+                delta = feed_transcription_stream(stream, audio_tail, final=True)
+                transcript = stream.confirmed_text.strip()
             
-            # Stream the response
-            with client.messages.stream(
-                model=os.environ.get("CLAUDE_MODEL", "claude-sonnet-4-5-20250929"),
-                max_tokens=8192,
-                system="You are a helpful voice assistant. Keep your responses concise and conversational since they will be displayed to a user who just spoke to you. Be friendly, natural, and helpful. Use markdown formatting when appropriate for readability.",
-                messages=history
-            ) as stream:
-                for text in stream.text_stream:
-                    full_response += text
-                    # Send each chunk as a server-sent event
-                    yield f"data: {json.dumps({'chunk': text})}\n\n"
+            if delta:
+                yield b"data: " + orjson.dumps({'transcript_delta': delta}) + b"\n\n"
+            yield b"data: " + orjson.dumps({'transcript': transcript}) + b"\n\n"
             
-            # Add assistant response to history
-            history.append({
-                'role': 'assistant',
-                'content': full_response
-            })
+            if not transcript:
+                yield b"data: " + orjson.dumps({'done': True}) + b"\n\n"
+                return
             
-            # Limit history size
-            if len(history) > MAX_HISTORY_MESSAGES:
-                conversation_histories[session_id] = history[-MAX_HISTORY_MESSAGES:]
+            if transcript != speculative_text and reply:
+                # The tail changed the message, so the speculative reply is stale
+                reply.cancel()
+                reply = None
             
-            # Save to disk
-            save_conversation_history()
+            for text in run_turn(session_id, transcript, reply):
+                yield b"data: " + orjson.dumps({'response_delta': text}) + b"\n\n"
             
             # Send done signal
-            yield f"data: {json.dumps({'done': True})}\n\n"
+            yield b"data: " + orjson.dumps({'done': True}) + b"\n\n"
             
         except Exception as e:
-            print(f"Stream error: {e}")
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            print(f"Voice turn error: {e}")
+            yield b"data: " + orjson.dumps({'error': str(e)}) + b"\n\n"
+        
+        finally:
+            # Also runs if the client disconnects mid-reply
+            if reply:
+                reply.cancel()
+            with transcription_streams_lock:
+                transcription_streams.pop(stream_id, None)
     
     return Response(
         stream_with_context(generate()),
@@ -350,9 +1167,14 @@ def clear_history():
         data = request.get_json()
         session_id = data.get('session_id', 'default')
         
-        if session_id in conversation_histories:
-            conversation_histories[session_id] = []
-            save_conversation_history()
+        with history_lock:
+            if session_id in conversation_histories:
+                conversation_histories[session_id] = []
+                session_generations[session_id] = session_generations.get(session_id, 0) + 1
+                context_starts.pop(session_id, None)
+                forget_session_preview(session_id)
+                update_session_index(session_id)
+                remove_history_file(session_id)
         
         return jsonify({'status': 'cleared'})
         
@@ -374,43 +1196,60 @@ def health_check():
 @app.route('/api/sessions', methods=['GET'])
 def list_sessions():
     """List all saved conversation sessions."""
-    sessions = []
-    for session_id, history in conversation_histories.items():
-        if history:  # Only include non-empty sessions
-            # Get first user message as preview
-            preview = ""
-            for msg in history:
-                if msg['role'] == 'user':
-                    preview = msg['content'][:100] + ('...' if len(msg['content']) > 100 else '')
-                    break
-            
-            sessions.append({
-                'session_id': session_id,
-                'message_count': len(history),
-                'preview': preview
-            })
+    global _sessions_payload
+    
+    with history_lock:
+        version, payload = _sessions_payload
+        if version != sessions_version:
+            sessions = [
+                {'session_id': session_id, **summary}
+                for session_id, summary in session_index.items()
+                if summary['message_count']  # Only include non-empty sessions
+            ]
+            payload = orjson.dumps({'sessions': sessions})
+            _sessions_payload = (sessions_version, payload)
     
-    return jsonify({'sessions': sessions})
+    return Response(payload, mimetype='application/json')
 
 
 @app.route('/api/session/<session_id>', methods=['GET'])
 def get_session(session_id):
-    """Get conversation history for a specific session."""
-    if session_id not in conversation_histories:
-        return jsonify({'error': 'Session not found'}), 404
+    """
+    Get conversation history for a specific session.
+    
+    Query parameters:
+        - offset: index of the first message to return (default 0)
+        - limit: number of messages to return (default and maximum SESSION_PAGE_SIZE)
+    """
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', SESSION_PAGE_SIZE, type=int), 1), SESSION_PAGE_SIZE)
+    
+    with history_lock:
+        if session_id not in conversation_histories:
+            return jsonify({'error': 'Session not found'}), 404
+        history = conversation_histories[session_id]
+        messages = history[offset:offset + limit]
+        total = len(history)
     
     return jsonify({
         'session_id': session_id,
-        'messages': conversation_histories[session_id]
+        'messages': msgspec.to_builtins(messages),
+        'offset': offset,
+        'limit': limit,
+        'total': total
     })
 
 
 @app.route('/api/session/<session_id>', methods=['DELETE'])
 def delete_session(session_id):
     """Delete a specific session."""
-    if session_id in conversation_histories:
-        del conversation_histories[session_id]
-        save_conversation_history()
+    with history_lock:
+        if conversation_histories.pop(session_id, None) is not None:
+            session_generations[session_id] = session_generations.get(session_id, 0) + 1
+            context_starts.pop(session_id, None)
+            forget_session_preview(session_id)
+            update_session_index(session_id)
+            remove_history_file(session_id)
     
     return jsonify({'status': 'deleted'})
 
@@ -425,7 +1264,9 @@ if __name__ == '__main__':
     print("\nStarting server at http://localhost:5001")
     print("Press Ctrl+C to stop\n")
     
-    # Pre-load Whisper model
-    get_whisper_model()
+    if WARMUP:
+        warm_up_claude_client()
     
-    app.run(host='0.0.0.0', port=5001, debug=False)
+    # Threaded so chats waiting on Claude don't block other requests.
+    # For production: gunicorn -c gunicorn.conf.py server:app
+    app.run(host='0.0.0.0', port=5001, debug=False, threaded=True)
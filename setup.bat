@@ -50,7 +50,7 @@ REM Install dependencies
 echo [4/5] Installing dependencies (this may take a few minutes)...
 echo    - Flask (web server)
 echo    - flask-cors (cross-origin support)
-echo    - openai-whisper (speech recognition)
+echo    - faster-whisper (speech recognition)
 echo    - anthropic (Claude API)
 echo    - python-dotenv (environment variables)
 echo.